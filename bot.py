@@ -3,22 +3,35 @@ import discord
 from discord.ext import commands, tasks
 from discord import app_commands
 import os
-import json
+import io
+import mmap
+import gzip
+import hashlib
+import heapq
+import orjson
+import asyncio
 from datetime import datetime
 import time
 import traceback
+from collections import OrderedDict
+
+_now = datetime.now  # bound once; used on the per-command path
 
 # --- Load Config ---
 CONFIG_FILE = "config.json"
 
+def read_json(path):
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        with memoryview(mm) as view:
+            return orjson.loads(view)
+
 def load_config():
     if not os.path.exists(CONFIG_FILE):
         print("[ERROR] config.json not found!")
         exit()
     try:
-        with open(CONFIG_FILE, "r") as f:
-            return json.load(f)
-    except json.JSONDecodeError:
+        return read_json(CONFIG_FILE)
+    except ValueError:  # orjson.JSONDecodeError, or mmap of an empty file
         print("[ERROR] Could not parse config.json")
         exit()
 
@@ -27,28 +40,35 @@ BOT_TOKEN = config.get("bot_token")
 LOG_CHANNEL_ID = config.get("logChannelId")
 GETACC_COOLDOWN = config.get("getAccCooldown", 300)
 BOT_PREFIX = config.get("bot_prefix", ".")
+VERBOSE_CONSOLE = config.get("verboseConsole", True)  # print non-error logs to the console
 
 # --- Bot Setup ---
 intents = discord.Intents.all()
 bot = commands.Bot(command_prefix=BOT_PREFIX, intents=intents)
 
+# --- Timestamps ---
+def format_timestamp(n):
+    # Plain int formatting; avoids strftime's format parsing on every command
+    return f"{n.year:04d}-{n.month:02d}-{n.day:02d} {n.hour:02d}:{n.minute:02d}:{n.second:02d}"
+
 # --- Logging Helper ---
+_LOG_COLORS = {
+    "error": discord.Color.red(),
+    "success": discord.Color.green(),
+    "warning": discord.Color.orange(),
+}
+_log_channel = None  # resolved once in on_ready
+
 async def send_log(message, log_type="info"):
-    timestamp = datetime.now().strftime("[%Y-%m-%d %H:%M:%S]")
-    print(f"{timestamp} {message}")
-    if LOG_CHANNEL_ID:
-        channel = bot.get_channel(LOG_CHANNEL_ID)
-        if channel:
-            color = discord.Color.blue()
-            if log_type == "error":
-                color = discord.Color.red()
-            elif log_type == "success":
-                color = discord.Color.green()
-            elif log_type == "warning":
-                color = discord.Color.orange()
-            embed = discord.Embed(description=message, color=color, timestamp=datetime.now())
-            embed.set_footer(text="Bot Logs")
-            await channel.send(embed=embed)
+    now = _now()
+    if VERBOSE_CONSOLE or log_type == "error":
+        print(f"[{format_timestamp(now)}] {message}")
+    if _log_channel is None:
+        return
+    color = _LOG_COLORS.get(log_type, discord.Color.blue())
+    embed = discord.Embed(description=message, color=color, timestamp=now)
+    embed.set_footer(text="Bot Logs")
+    await _log_channel.send(embed=embed)
 
 # --- Analytics ---
 ANALYTICS_FILE = "analytics.json"
@@ -57,16 +77,41 @@ def load_analytics():
     if not os.path.exists(ANALYTICS_FILE):
         return {}
     try:
-        with open(ANALYTICS_FILE, "r") as f:
-            return json.load(f)
+        return read_json(ANALYTICS_FILE)
     except:
         return {}
 
 def save_analytics(data):
-    with open(ANALYTICS_FILE, "w") as f:
-        json.dump(data, f, indent=4)
+    # orjson.dumps encodes in a single C call, so the event loop can't mutate the dict mid-encode
+    payload = orjson.dumps(data)
+    tmp_file = f"{ANALYTICS_FILE}.tmp"
+    with open(tmp_file, "wb") as f:
+        f.write(payload)
+    os.replace(tmp_file, ANALYTICS_FILE)
+
+def build_cmd_index(data):
+    # cmd -> {user: info}; info dicts are shared with analytics_data so counts stay in sync
+    index = {}
+    for user, commands_used in data.items():
+        for cmd, info in commands_used.items():
+            index.setdefault(cmd, {})[user] = info
+    return index
 
 analytics_data = load_analytics()
+cmd_index = build_cmd_index(analytics_data)
+_analytics_dirty = False
+
+@tasks.loop(seconds=30)
+async def flush_analytics():
+    global _analytics_dirty
+    if not _analytics_dirty:
+        return
+    _analytics_dirty = False
+    try:
+        await asyncio.to_thread(save_analytics, analytics_data)
+    except Exception as e:
+        _analytics_dirty = True
+        print(f"[WARN] Could not save analytics: {e}")
 
 # --- Import Helpers ---
 from helpers.roblox_version import RobloxVersion
@@ -77,47 +122,87 @@ roblox_version = RobloxVersion(send_log_func=send_log)
 account_manager = AccountManager(getacc_cooldown=GETACC_COOLDOWN, send_log_func=send_log)
 
 # --- Status Updater ---
-status_messages = [
-    lambda: account_manager.status_text(),
+STATUS_CALLBACKS = (
+    account_manager.status_text,
     lambda: "/getacc for free accounts",
     lambda: "/stock to check balance",
-    lambda: roblox_version.status_text()
-]
+    roblox_version.status_text,
+)
+N_STATUS = len(STATUS_CALLBACKS)
+VERSION_STATUS_INDEX = 3
 
 @tasks.loop(seconds=30)
 async def update_status():
-    current_status = status_messages[update_status.current_loop % len(status_messages)]()
+    current_status = STATUS_CALLBACKS[update_status.current_loop % N_STATUS]()
     await bot.change_presence(activity=discord.Activity(type=discord.ActivityType.watching, name=current_status))
 
+# --- Command Sync ---
+TREE_HASH_FILE = ".tree_hash"
+
+def command_tree_hash():
+    # Include the application id so a .tree_hash left by another bot/token never suppresses a sync
+    spec = {
+        "application_id": bot.application_id,
+        "commands": [c.to_dict(bot.tree) for c in bot.tree.get_commands()],
+    }
+    return hashlib.sha1(orjson.dumps(spec, option=orjson.OPT_SORT_KEYS)).hexdigest()
+
+async def sync_command_tree():
+    # on_ready fires on every reconnect; only hit the API when the commands actually changed
+    tree_hash = command_tree_hash()
+    try:
+        with open(TREE_HASH_FILE, "r") as f:
+            if f.read().strip() == tree_hash:
+                return
+    except OSError:
+        pass
+    await bot.tree.sync()
+    with open(TREE_HASH_FILE, "w") as f:
+        f.write(tree_hash)
+
 # --- Events ---
 @bot.event
 async def on_ready():
+    global _log_channel
     print(f"✅ Logged in as {bot.user} ({bot.user.id})")
-    await bot.tree.sync()
-    update_status.start()
+    if LOG_CHANNEL_ID:
+        _log_channel = bot.get_channel(LOG_CHANNEL_ID)
+    # Start the loops before any network work so a failed sync can't leave analytics unflushed
+    if not flush_analytics.is_running():
+        flush_analytics.start()
+    if not update_status.is_running():
+        update_status.start()
+    await sync_command_tree()
     await send_log("🤖 Bot is online and ready!", "success")
 
 # --- Automatic Command Logging + Analytics ---
 @bot.event
 async def on_app_command_completion(interaction: discord.Interaction, command: app_commands.Command):
+    global _analytics_dirty
     try:
+        # Gather everything about the event in one pass
         user = str(interaction.user)
         cmd_name = command.qualified_name
+        should_log = _log_channel is not None or VERBOSE_CONSOLE
+        params_str = None
+        if should_log:
+            items = [(k, v) for k, v in interaction.namespace.__dict__.items() if k[:1] != '_']
+            if items:
+                params_str = ", ".join("%s=%s" % kv for kv in items)
 
         # --- Update Analytics ---
-        if user not in analytics_data:
-            analytics_data[user] = {}
-        if cmd_name not in analytics_data[user]:
-            analytics_data[user][cmd_name] = {"count": 0, "last_used": None}
-
-        analytics_data[user][cmd_name]["count"] += 1
-        analytics_data[user][cmd_name]["last_used"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        save_analytics(analytics_data)
+        entry = analytics_data.setdefault(user, {}).setdefault(cmd_name, {"count": 0, "last_used": None})
+        if entry["count"] == 0:
+            cmd_index.setdefault(cmd_name, {})[user] = entry
+        entry["count"] += 1
+        entry["last_used"] = format_timestamp(_now())
+        _analytics_dirty = True
 
         # --- Log the command usage ---
-        params = ", ".join(f"{k}={v}" for k, v in interaction.namespace.__dict__.items() if not k.startswith('_'))
-        if params:
-            log_msg = f"📌 User `{user}` used `/{cmd_name}` with params: {params}"
+        if not should_log:
+            return
+        if params_str:
+            log_msg = f"📌 User `{user}` used `/{cmd_name}` with params: {params_str}"
         else:
             log_msg = f"📌 User `{user}` used `/{cmd_name}`"
         await send_log(log_msg, "success")
@@ -126,11 +211,19 @@ async def on_app_command_completion(interaction: discord.Interaction, command: a
         print(f"[WARN] Could not log command usage: {e}")
 
 # --- Global Error Logging ---
+def format_command_error(error):
+    # discord.py's own errors (MissingPermissions, CommandOnCooldown, ...) already carry a readable message
+    if isinstance(error, app_commands.AppCommandError):
+        err_text = str(error)
+        if err_text:
+            return err_text
+    return "".join(traceback.format_exception_only(type(error), error)).strip()
+
 @bot.tree.error
 async def global_command_error(interaction: discord.Interaction, error):
     user = interaction.user
     cmd_name = interaction.command.qualified_name if interaction.command else "Unknown"
-    err_text = "".join(traceback.format_exception_only(type(error), error)).strip()
+    err_text = format_command_error(error)
     msg = f"❌ Command `{cmd_name}` by `{user}` failed → {err_text}"
     await send_log(msg, "error")
     try:
@@ -138,11 +231,34 @@ async def global_command_error(interaction: discord.Interaction, error):
     except:
         pass
 
+# --- Admin Check ---
+ADMIN_CACHE_TTL = 30
+ADMIN_CACHE_MAX_ENTRIES = 256
+_admin_cache = OrderedDict()  # (guild_id, user_id) -> (is_admin, expires_at), soonest expiry first
+
+def is_admin(interaction: discord.Interaction):
+    key = (interaction.guild_id, interaction.user.id)
+    now = time.monotonic()
+    # Entries are kept in insertion order with a fixed TTL, so expired ones are always at the front
+    while _admin_cache:
+        oldest_key, (_, expires_at) = next(iter(_admin_cache.items()))
+        if expires_at > now:
+            break
+        del _admin_cache[oldest_key]
+    hit = _admin_cache.get(key)
+    if hit:
+        return hit[0]
+    value = interaction.user.guild_permissions.administrator
+    _admin_cache[key] = (value, now + ADMIN_CACHE_TTL)
+    if len(_admin_cache) > ADMIN_CACHE_MAX_ENTRIES:
+        _admin_cache.popitem(last=False)
+    return value
+
 # --- Commands ---
 # Add Account
 @bot.tree.command(name="addacc", description="Add account (Admins only)")
 async def add_account_cmd(interaction: discord.Interaction, account_string: str):
-    if not interaction.user.guild_permissions.administrator:
+    if not is_admin(interaction):
         await interaction.response.send_message("❌ Admin only!", ephemeral=True)
         raise app_commands.MissingPermissions(["administrator"])
     success, msg = account_manager.add_account(account_string)
@@ -157,6 +273,7 @@ async def get_account_cmd(interaction: discord.Interaction):
             await interaction.user.send(f"🔑 {acc}")
             await interaction.response.send_message("✅ Sent via DM!", ephemeral=True)
         except Exception as e:
+            # Kept on the event loop: load/insert/save must not interleave with other /getacc or /addacc calls
             accounts = account_manager.load_accounts()
             accounts.insert(0, acc)
             account_manager.save_accounts(accounts)
@@ -180,49 +297,64 @@ async def ping_cmd(interaction: discord.Interaction):
     await interaction.response.send_message(f"🏓 {latency}ms", ephemeral=True)
 
 # Roblox Version
+_version_embeds = {}  # (title, version, date) -> Embed; the version rarely changes
+
+def version_embed(title, ver, date):
+    key = (title, ver, date)
+    embed = _version_embeds.get(key)
+    if embed is None:
+        if len(_version_embeds) >= 8:
+            _version_embeds.clear()
+        embed = discord.Embed(title=title, color=0x43B581)
+        embed.add_field(name="Platform", value="Windows", inline=True)
+        embed.add_field(name="Version", value=ver, inline=True)
+        embed.add_field(name="Date", value=date if date else "Unknown", inline=True)
+        _version_embeds[key] = embed
+    return embed
+
 @bot.tree.command(name="version", description="Current Roblox version")
 async def version_cmd(interaction: discord.Interaction):
     data = roblox_version.fetch()
     ver = data.get("version")
     date = data.get("date")
     if ver:
-        embed = discord.Embed(title="Roblox Version", color=0x43B581)
-        embed.add_field(name="Platform", value="Windows", inline=True)
-        embed.add_field(name="Version", value=ver, inline=True)
-        embed.add_field(name="Date", value=date if date else "Unknown", inline=True)
-        await interaction.response.send_message(embed=embed)
+        await interaction.response.send_message(embed=version_embed("Roblox Version", ver, date))
     else:
         await interaction.response.send_message("⚠️ Could not fetch Roblox version.")
 
 # Refresh Roblox Version (Admin only)
-refresh_cooldowns = {}
+refresh_cooldowns = OrderedDict()  # uid -> last refresh, oldest first
 REFRESH_COOLDOWN = 60
+REFRESH_COOLDOWN_MAX_ENTRIES = 256
 
 @bot.tree.command(name="refreshversion", description="Force refresh Roblox version cache (Admins only)")
 async def refresh_version(interaction: discord.Interaction):
-    if not interaction.user.guild_permissions.administrator:
+    if not is_admin(interaction):
         await interaction.response.send_message("❌ Admin only!", ephemeral=True)
         raise app_commands.MissingPermissions(["administrator"])
     uid = interaction.user.id
-    now = time.time()
-    last = refresh_cooldowns.get(uid, 0)
-    if now - last < REFRESH_COOLDOWN:
+    now = time.monotonic()
+    # Entries are kept in refresh order, so expired ones are always at the front
+    while refresh_cooldowns:
+        oldest_uid, oldest = next(iter(refresh_cooldowns.items()))
+        if now - oldest < REFRESH_COOLDOWN:
+            break
+        del refresh_cooldowns[oldest_uid]
+    last = refresh_cooldowns.get(uid)
+    if last is not None and now - last < REFRESH_COOLDOWN:
         wait = round(REFRESH_COOLDOWN - (now - last), 1)
         await interaction.response.send_message(f"⏳ Cooldown: {wait}s left", ephemeral=True)
         return
     refresh_cooldowns[uid] = now
+    if len(refresh_cooldowns) > REFRESH_COOLDOWN_MAX_ENTRIES:
+        refresh_cooldowns.popitem(last=False)
     data = roblox_version.force_refresh()
     ver = data.get("version")
     date = data.get("date")
     if ver:
-        embed = discord.Embed(title="Roblox Version (Refreshed)", color=0x43B581)
-        embed.add_field(name="Platform", value="Windows", inline=True)
-        embed.add_field(name="Version", value=ver, inline=True)
-        embed.add_field(name="Date", value=date if date else "Unknown", inline=True)
-        await interaction.response.send_message(embed=embed)
+        await interaction.response.send_message(embed=version_embed("Roblox Version (Refreshed)", ver, date))
         try:
-            current_index = update_status.current_loop % len(status_messages)
-            if status_messages[current_index] == status_messages[3]:
+            if update_status.current_loop % N_STATUS == VERSION_STATUS_INDEX:
                 new_status = roblox_version.status_text()
                 await bot.change_presence(activity=discord.Activity(type=discord.ActivityType.watching, name=new_status))
         except Exception as e:
@@ -231,9 +363,17 @@ async def refresh_version(interaction: discord.Interaction):
         await interaction.response.send_message("⚠️ Could not fetch Roblox version.")
 
 # Analytics Command (Admin only)
+ANALYTICS_GZIP_USERS = 50  # above this many users, skip the inline attempt and upload a gzipped file
+
+def iter_analytics_lines():
+    for user, commands_used in analytics_data.items():
+        yield f"**{user}**\n"
+        for cmd, info in commands_used.items():
+            yield f"  - {cmd}: {info['count']} times (last: {info['last_used']})\n"
+
 @bot.tree.command(name="analytics", description="View command usage analytics (Admins only)")
 async def analytics_cmd(interaction: discord.Interaction):
-    if not interaction.user.guild_permissions.administrator:
+    if not is_admin(interaction):
         await interaction.response.send_message("❌ Admin only!", ephemeral=True)
         return
 
@@ -241,40 +381,40 @@ async def analytics_cmd(interaction: discord.Interaction):
         await interaction.response.send_message("⚠️ No analytics data yet.", ephemeral=True)
         return
 
-    msg_lines = []
-    for user, commands_used in analytics_data.items():
-        msg_lines.append(f"**{user}**")
-        for cmd, info in commands_used.items():
-            msg_lines.append(f"  - {cmd}: {info['count']} times (last: {info['last_used']})")
-    msg_text = "\n".join(msg_lines)
+    buf = io.StringIO()
+    buf.writelines(iter_analytics_lines())
+    msg_text = buf.getvalue().rstrip("\n")
+
+    if len(analytics_data) > ANALYTICS_GZIP_USERS:
+        # Compress off the event loop; this branch only runs for large histories
+        data = await asyncio.to_thread(gzip.compress, msg_text.encode("utf-8"), 6)
+        file = discord.File(io.BytesIO(data), filename="analytics.txt.gz")
+        await interaction.response.send_message("📊 Analytics for many users, sending compressed file:", file=file, ephemeral=True)
+        return
 
     if len(msg_text) > 1900:
-        with open("analytics.txt", "w", encoding="utf-8") as f:
-            f.write(msg_text)
-        await interaction.response.send_message("📊 Analytics too long, sending file:", file=discord.File("analytics.txt"), ephemeral=True)
+        file = discord.File(io.BytesIO(msg_text.encode("utf-8")), filename="analytics.txt")
+        await interaction.response.send_message("📊 Analytics too long, sending file:", file=file, ephemeral=True)
     else:
         await interaction.response.send_message(f"📊 **Command Usage Analytics:**\n{msg_text}", ephemeral=True)
 
 # Leaderboard Command (Admin only)
 @bot.tree.command(name="leaderboard", description="View top users of a specific command (Admins only)")
 async def leaderboard_cmd(interaction: discord.Interaction, command_name: str):
-    if not interaction.user.guild_permissions.administrator:
+    if not is_admin(interaction):
         await interaction.response.send_message("❌ Admin only!", ephemeral=True)
         return
 
-    leaderboard = []
-    for user, commands_used in analytics_data.items():
-        if command_name in commands_used:
-            leaderboard.append((user, commands_used[command_name]["count"], commands_used[command_name]["last_used"]))
+    leaderboard = [(user, info["count"], info["last_used"]) for user, info in cmd_index.get(command_name, {}).items()]
 
     if not leaderboard:
         await interaction.response.send_message(f"⚠️ No usage data found for `/{command_name}`.", ephemeral=True)
         return
 
-    leaderboard.sort(key=lambda x: x[1], reverse=True)
+    top = heapq.nlargest(10, leaderboard, key=lambda x: x[1])
 
     msg_lines = [f"🏆 **Leaderboard for /{command_name}**"]
-    for i, (user, count, last_used) in enumerate(leaderboard[:10], start=1):
+    for i, (user, count, last_used) in enumerate(top, start=1):
         msg_lines.append(f"{i}. {user} — {count} times (last: {last_used})")
 
     msg_text = "\n".join(msg_lines)
@@ -286,3 +426,5 @@ if __name__ == "__main__":
         print("[ERROR] Missing bot token!")
     else:
         bot.run(BOT_TOKEN)
+        if _analytics_dirty:
+            save_analytics(analytics_data)